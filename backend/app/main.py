@@ -4,14 +4,22 @@
 
 # FastAPI e utilitários
 from fastapi                 import FastAPI, File, UploadFile, HTTPException  # importa FastAPI e tipos/erros para endpoints de upload
-from fastapi.responses       import JSONResponse                              # importa JSONResponse para retornar JSON customizado
 from fastapi.middleware.cors import CORSMiddleware                            # importa middleware CORS para permitir chamadas do frontend
+from pydantic                import BaseModel                                 # modelos tipados de requisição/resposta (serialização pelo pydantic)
 
-# Matching aproximado, leitura de bytes, regex, ID de sessão, normalização de caracteres
-from difflib                 import get_close_matches                         # para similaridade de strings (detecta colunas aproximadas)
-from io                      import BytesIO                                   
+# Matching aproximado, arquivo temporário, cache de sessões e locks, tipos do pandas, regex, ID de sessão, normalização de caracteres
+from rapidfuzz               import fuzz                                      # para similaridade de strings (detecta colunas aproximadas)
+from tempfile                import NamedTemporaryFile, gettempdir            # arquivo temporário para o upload em streaming
+from pathlib                 import Path                                      # caminhos do cache em Parquet
+from cachetools              import TTLCache                                  # cache de sessões com limite de tamanho e expiração
+from collections             import deque                                     # histórico limitado por sessão
+from threading               import Lock                                      # acesso concorrente a sessões e históricos
+from pandas.api.types        import is_numeric_dtype                          # identifica colunas numéricas (sum/mean)
 
-import re, uuid, unicodedata, uvicorn, pandas as pd                           
+import os, re, time, uuid, unicodedata, uvicorn, numpy as np, pandas as pd
+import pyarrow as pa, pyarrow.compute as pc                                   # kernels vetorizados de string (normalização)
+import ahocorasick                                                            # busca de vários termos numa passada (colunas na pergunta)
+import xxhash                                                                 # hash rápido do conteúdo do upload (chave do cache)
 
 
 # ============================
@@ -31,7 +39,38 @@ app.add_middleware(
 
 # Armazena DataFrames por sessão.
 # Cada vez que o usuário faz upload, criamos um session_id único e guardamos o DF.
-sessions = {}
+# O cache é limitado: sessões expiram após SESSION_TTL segundos e, passando de
+# SESSION_MAXSIZE, as menos usadas são descartadas (evita crescer a memória para sempre).
+SESSION_MAXSIZE = 128
+SESSION_TTL     = 3600
+sessions = TTLCache(maxsize=SESSION_MAXSIZE, ttl=SESSION_TTL)
+sessions_lock = Lock()                                                        # TTLCache não é thread-safe (/ask roda no threadpool)
+
+# Quantidade máxima de perguntas/respostas mantidas no histórico de cada sessão.
+HISTORY_MAXLEN = 50
+
+# Resultado do índice de filtros para valores inexistentes (nenhuma linha).
+NO_ROWS = np.array([], dtype=np.intp)
+
+# Colunas com mais valores distintos que essa fração das linhas (ids, nomes)
+# não ganham índice invertido: ele custaria quase uma entrada por linha.
+INDEX_MAX_DISTINCT_RATIO = 0.1
+
+# Tamanho dos blocos lidos do upload ao gravar o arquivo em disco.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Planilhas já processadas (com colunas *_norm) ficam em Parquet, indexadas pelo
+# hash do conteúdo: reenviar o mesmo arquivo não exige ler o .xlsx de novo.
+CACHE_DIR = Path(gettempdir()) / "psel_cache"
+
+# Versão do processamento gravado no cache (normalize_series, prepare_normalized_columns).
+# Incrementar ao mudar a normalização: arquivos de versões antigas deixam de ser lidos.
+CACHE_VERSION = "v1"
+
+# Limites do cache em disco: arquivos mais antigos que CACHE_MAX_AGE segundos são
+# removidos e, passando de CACHE_MAX_FILES, os menos usados são descartados.
+CACHE_MAX_FILES = 64
+CACHE_MAX_AGE   = 7 * 24 * 3600
 
 
 # ======================================================================
@@ -46,8 +85,11 @@ def normalize_text(text):
     """Normaliza texto para facilitar comparação: remove acentos, caracteres especiais e deixa minúsculo."""
     if text is None:
         return ""
+    s = str(text)
+    if s.isascii():                               # sem acentos: NFKD e encode/decode não mudariam nada
+        return s.lower().strip()
     return (
-        unicodedata.normalize('NFKD', str(text))  # remove acentos
+        unicodedata.normalize('NFKD', s)          # remove acentos
                   .encode('ASCII', 'ignore')       # remove caracteres não ASCII
                   .decode('utf-8')
                   .lower()
@@ -55,87 +97,221 @@ def normalize_text(text):
     )
 
 
+# caracteres descartados na normalização de valores (mantém letras, dígitos, espaços e hífen).
+# Fica como string pois é consumido pelo motor de regex do pyarrow, não pelo módulo re.
+_NORM_STRIP = r'[^a-zA-Z0-9\s\-]+'
+
+
 def normalize_series(s):
     """
-    Normaliza uma série inteira do pandas, aplicando normalize_text e removendo caracteres
-    que não interessam. Mantém hífen pois é útil para alguns valores.
+    Normaliza uma série inteira do pandas com o mesmo resultado de normalize_text,
+    removendo caracteres que não interessam. Mantém hífen pois é útil para alguns valores.
+    Usa kernels do pyarrow (laço em C) em vez de chamar normalize_text célula a célula.
     """
-    return (
-        s.astype(str)
-         .apply(normalize_text)
-         .str.replace(r'[^a-z0-9\s\-]+', '', regex=True)
-         .str.strip()
-    )
+    arr = pa.array(s.astype(str), type=pa.string())
+    arr = pc.fill_null(arr, "nan")                                   # mesmo texto que str(NaN) geraria
+    arr = pc.utf8_normalize(arr, form="NFKD")                        # separa acentos das letras
+    arr = pc.replace_substring_regex(arr, _NORM_STRIP, '')           # remove acentos, não ASCII e especiais
+    arr = pc.ascii_lower(arr)
+    arr = pc.utf8_trim_whitespace(arr)
+    return pd.Series(arr.to_numpy(zero_copy_only=False), index=s.index, name=s.name)
 
 
 def prepare_normalized_columns(df: pd.DataFrame):
     """
     Cria colunas auxiliares *_norm em todas as colunas,
     preservando as originais e criando versões normalizadas para filtros textuais.
+    As colunas *_norm são categóricas: filtros de igualdade comparam códigos inteiros.
     """
     for col in list(df.columns):
-        df[col + "_norm"] = normalize_series(df[col])
+        df[col + "_norm"] = normalize_series(df[col]).astype("category")
     return df
 
 
-# ======================================================================
-# EXTRAÇÃO DE COLUNA CANDIDATA A PARTIR DA PERGUNTA DO USUÁRIO
-# ======================================================================
-
-def extract_column_candidate(question: str, columns: list, df: pd.DataFrame, numeric_only=False):
+def build_column_meta(df: pd.DataFrame):
     """
-    Tenta identificar qual coluna o usuário está se referindo na pergunta.
-    Usa normalização + pontuação por matching aproximado.
+    Pré-calcula, uma única vez por sessão, os dados de colunas usados em toda
+    pergunta (nomes normalizados, colunas numéricas, autômato de busca), evitando
+    renormalizar df.columns e inspecionar dtypes a cada chamada.
     """
-    q = normalize_text(question)
+    # colunas reais da planilha (sem as auxiliares *_norm) e quais delas são numéricas
+    columns = [c for c in df.columns if not str(c).endswith("_norm")]
+    numeric_cols = frozenset(c for c in columns if is_numeric_dtype(df[c]))
     columns_norm = [normalize_text(c) for c in columns]
 
-    best_col = None
-    best_score = 0
-
-    # tokens da pergunta para comparação
-    q_tokens = q.replace("=", " ").replace(">", " ").replace("<", " ").split()
-
+    # nome normalizado -> coluna (a primeira, se dois nomes normalizarem igual)
+    by_norm = {}
     for col, col_norm in zip(columns, columns_norm):
+        by_norm.setdefault(col_norm, col)
 
-        # ignorar colunas auxiliares *_norm
-        if str(col).endswith("_norm"):
+    # termos procurados na pergunta: nome normalizado da coluna ("full") e cada
+    # token separado por "_" ("tok"). Várias colunas podem compartilhar um termo.
+    termos = {}
+    for col, col_norm in zip(columns, columns_norm):
+        if not col_norm:
             continue
+        termos.setdefault(col_norm, []).append(("full", col))
+        for token in col_norm.split("_"):
+            if token:
+                termos.setdefault(token, []).append(("tok", col))
+
+    # autômato Aho-Corasick: encontra todos os termos numa única passada pela pergunta.
+    # Sem nenhum termo (planilha sem colunas ou cabeçalhos que normalizam para "",
+    # ex.: cirílico/CJK) o autômato não pode ser consultado: fica None.
+    automaton = None
+    if termos:
+        automaton = ahocorasick.Automaton()
+        for termo, entradas in termos.items():
+            automaton.add_word(termo, (termo, entradas))
+        automaton.make_automaton()
+
+    return {
+        "columns":      columns,
+        "columns_norm": columns_norm,
+        "numeric_cols": numeric_cols,
+        "positions":    {col: i for i, col in enumerate(columns)},   # desempate pela ordem das colunas
+        "by_norm":      by_norm,
+        "automaton":    automaton,
+        # índice invertido por coluna (preenchido sob demanda, ver get_value_index)
+        "index":        {},
+        # coluna resolvida para cada nome digitado em filtros (preenchido sob demanda)
+        "filter_columns": {},
+    }
+
+
+def tokenize(q: str):
+    """Conjunto de tokens de um texto já normalizado (ignora operadores =, >, <)."""
+    return set(q.replace("=", " ").replace(">", " ").replace("<", " ").split())
 
-        score = 0
 
-        # Se a operação for numérica, ignorar colunas não numéricas
-        if numeric_only:
-            from pandas.api.types import is_numeric_dtype
+# --------------------------------------------------------
+# CACHE EM PARQUET DOS DATAFRAMES JÁ PROCESSADOS
+# --------------------------------------------------------
+
+def load_cached_frame(path: Path):
+    """Lê o DataFrame em cache (Parquet preserva dtypes e categorias). Retorna None se não houver."""
+    try:
+        if not path.exists():
+            return None
+        df = pd.read_parquet(path)
+    except Exception:
+        # cache corrompido/ilegível: processa o .xlsx novamente
+        return None
+
+    try:
+        os.utime(path)                                   # marca como usado recentemente (ver prune_cache)
+    except OSError:
+        pass                                             # só afeta a ordem de descarte do cache
+
+    return df
+
+
+def save_cached_frame(df: pd.DataFrame, path: Path):
+    """
+    Grava o DataFrame processado em Parquet (zstd). Escreve num arquivo temporário
+    e renomeia, para nunca expor um cache incompleto. Falhas apenas deixam de cachear
+    (ex.: nomes de colunas não textuais ou colunas com tipos mistos).
+    """
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        # diretório do cache inacessível (ex.: de outro usuário ou existe como arquivo)
+        return
+
+    tmp_path = path.with_name(f"{path.stem}.{uuid.uuid4().hex}.tmp")
+    try:
+        df.to_parquet(tmp_path, compression="zstd")
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            tmp_path.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+    prune_cache(path.parent)
+
+
+def prune_cache(cache_dir: Path):
+    """
+    Mantém o cache limitado: remove arquivos mais velhos que CACHE_MAX_AGE (inclusive
+    versões antigas e temporários órfãos) e, acima de CACHE_MAX_FILES, os usados há mais tempo.
+    Erros de sistema de arquivos são ignorados: a limpeza nunca falha o upload.
+    """
+    entries = []
+    try:
+        for path in cache_dir.iterdir():
             try:
-                if not is_numeric_dtype(df[col]):
-                    continue
-            except Exception:
-                # se der erro, ignora checagem pra evitar crash
-                continue
+                entries.append((path.stat().st_mtime, path))
+            except OSError:
+                continue                                 # removido por outra requisição
+    except OSError:
+        return                                           # diretório ilegível
 
-        # coluna aparece literalmente na pergunta
-        if col_norm in q:
-            score += 3
+    entries.sort(reverse=True)                           # mais recentes primeiro
+    now = time.time()
 
-        # comparar tokens
-        for token in col_norm.split("_"):
-            if token in q_tokens:
-                score += 2
-            elif token in q:
-                score += 1
+    for i, (mtime, path) in enumerate(entries):
+        if i >= CACHE_MAX_FILES or now - mtime > CACHE_MAX_AGE:
+            try:
+                path.unlink(missing_ok=True)
+            except OSError:
+                continue                                 # sem permissão / não é arquivo
 
-        # similaridade aproximada
-        match = get_close_matches(col_norm, [q], n=1, cutoff=0.5)
-        if match:
-            score += 1
 
-        # atualiza melhor coluna
-        if score > best_score:
-            best_score = score
-            best_col = col
+# ======================================================================
+# EXTRAÇÃO DE COLUNA CANDIDATA A PARTIR DA PERGUNTA DO USUÁRIO
+# ======================================================================
 
-    return best_col
+def extract_column_candidate(q: str, q_tokens: set, df: pd.DataFrame, meta: dict, numeric_only=False):
+    """
+    Tenta identificar qual coluna o usuário está se referindo na pergunta.
+    Usa normalização + pontuação pelos termos das colunas encontrados na pergunta;
+    matching aproximado só entra quando nenhum termo é encontrado.
+    Recebe a pergunta já normalizada (q) e seus tokens (q_tokens).
+    """
+    numeric_cols = meta["numeric_cols"]
+    positions    = meta["positions"]
+
+    # atalho: um token da pergunta é exatamente o nome de uma coluna
+    exact = [meta["by_norm"][token] for token in meta["by_norm"].keys() & q_tokens]
+    if numeric_only:
+        exact = [col for col in exact if col in numeric_cols]
+    if exact:
+        return min(exact, key=positions.__getitem__)
+
+    # termos das colunas presentes na pergunta (cada termo conta uma única vez)
+    automaton = meta["automaton"]
+    found = {termo: entradas for _, (termo, entradas) in automaton.iter(q)} if automaton is not None else {}
+
+    scores = {}
+    for termo, entradas in found.items():
+        for kind, col in entradas:
+            if kind == "full":                      # coluna aparece literalmente na pergunta
+                points = 3
+            elif termo in q_tokens:                 # token da coluna é um token da pergunta
+                points = 2
+            else:                                   # token da coluna aparece dentro da pergunta
+                points = 1
+            scores[col] = scores.get(col, 0) + points
+
+    # Se a operação for numérica, ignorar colunas não numéricas
+    if numeric_only:
+        scores = {col: score for col, score in scores.items() if col in numeric_cols}
+
+    if scores:
+        # maior pontuação; em caso de empate, a primeira coluna da planilha
+        return max(scores, key=lambda col: (scores[col], -positions[col]))
+
+    # fallback: similaridade aproximada
+    for col, col_norm in zip(meta["columns"], meta["columns_norm"]):
+
+        if numeric_only and col not in numeric_cols:
+            continue
+
+        if fuzz.ratio(col_norm, q, score_cutoff=50):
+            return col
+
+    return None
 
 
 # ======================================================================
@@ -143,7 +319,7 @@ def extract_column_candidate(question: str, columns: list, df: pd.DataFrame, num
 # ======================================================================
 
 def apply_count(df, col):
-    return len(df[col].dropna())
+    return int(df[col].count())                   # não nulos, sem materializar uma cópia sem NaN
 
 def apply_sum(df, col):
     try:
@@ -158,7 +334,7 @@ def apply_mean(df, col):
         return f"Não é possível calcular a média da coluna '{col}': {e}"
 
 def apply_list(df, col):
-    return df[col].dropna().unique().tolist()
+    return df[col].drop_duplicates().dropna().tolist()   # deduplica antes, dropna roda só sobre os valores únicos
 
 
 def execute_operation(intent, df, col):
@@ -187,81 +363,100 @@ def execute_operation(intent, df, col):
 # DETECÇÃO DE INTENÇÃO (sum/count/mean/list)
 # ======================================================================
 
-def is_count_intent(q: str) -> bool:
-    return any(k in q for k in ["quantos", "quantas", "contagem", "número de", "numero de"])
-
-def is_sum_intent(q: str) -> bool:
-    return any(k in q for k in ["soma", "somar", "somatório", "somatorio", "totalizar", "total da"])
+# Palavras-chave de cada intenção, em ordem de prioridade. A pergunta chega
+# normalizada (sem acentos), então só as formas sem acento são necessárias.
+# "total" é o fallback que decide entre sum/count pela coluna encontrada.
+INTENT_KEYWORDS = {
+    "mean":  ["media", "valor medio"],
+    "sum":   ["soma", "somar", "somatorio", "totalizar", "total da"],
+    "count": ["quantos", "quantas", "contagem", "numero de"],
+    "list":  ["listar", "liste", "mostre", "mostra", "mostrar", "exibir", "exiba", "quais",
+              "me de", "retornar", "retorne", "trazer", "traga"],
+    "total": ["total de"],
+}
 
-def is_mean_intent(q: str) -> bool:
-    return any(k in q for k in ["média", "media", "valor médio", "valor medio"])
+# Uma única regex com um grupo nomeado por intenção. O lookahead torna cada
+# match de largura zero, então palavras sobrepostas também são encontradas
+# e uma só passada pela pergunta equivale a testar todas as listas acima.
+_INTENT_RE = re.compile("(?=" + "|".join(
+    f"(?P<{intent}>" + "|".join(map(re.escape, sorted(keywords, key=len, reverse=True))) + ")"
+    for intent, keywords in INTENT_KEYWORDS.items()
+) + ")")
 
-def is_list_intent(question: str) -> bool:
-    keywords = [
-        "listar","liste","mostre","mostra","mostrar","exibir","exiba","quais",
-        "quais são","quais sao","me de","me dê","retornar","retorne","trazer","traga"
-    ]
-    return any(k in question for k in keywords)
 
-def has_total_phrase(q: str) -> bool:
-    return "total de" in q
+def find_intents(q: str) -> set:
+    """Intenções cujas palavras-chave aparecem no texto (uma passada pela regex)."""
+    return {m.lastgroup for m in _INTENT_RE.finditer(q)}
 
 
 # ======================================================================
 # DETECÇÃO DE FILTROS (ex: "onde empresa = X")
 # ======================================================================
 
+# Frases que iniciam o filtro ('onde', 'em que', 'por', etc), em ordem de
+# prioridade: frase maior primeiro para evitar conflitos. A prioridade vale
+# para a pergunta inteira ("onde" vence " em " mesmo aparecendo depois).
+FILTER_PHRASES = sorted([
+    "no qual", "na qual", "nos quais", "nas quais",
+    "onde", "em que",
+    " por ", " para ",
+    " no ", " na ", " nos ", " nas ",
+    " em "
+], key=len, reverse=True)
+
+# Uma única regex com um grupo por frase (f0 = maior prioridade). O lookahead
+# torna cada match de largura zero, então uma passada encontra todas as
+# ocorrências de todas as frases, inclusive sobrepostas.
+_FILTER_PHRASE_RE = re.compile("(?=" + "|".join(
+    f"(?P<f{i}>{re.escape(phrase)})" for i, phrase in enumerate(FILTER_PHRASES)
+) + ")")
+
+
 def has_filter_intent(question: str):
     """
     Detecta se a pergunta contém algo como 'onde', 'em que', 'por', etc.
+    Retorna a posição de início e fim da frase-chave de maior prioridade
+    (primeira ocorrência dela na pergunta).
     """
-    filter_phrases = [
-        "no qual", "na qual", "nos quais", "nas quais",
-        "onde", "em que",
-        " por ", " para ",
-        " no ", " na ", " nos ", " nas ",
-        " em "
-    ]
-
-    # frasa maior primeiro para evitar conflitos
-    filter_phrases = sorted(filter_phrases, key=len, reverse=True)
+    best = None
+    for m in _FILTER_PHRASE_RE.finditer(question):
+        rank = int(m.lastgroup[1:])
+        if best is None or rank < best[0]:
+            best = (rank, m.start(), m.end(m.lastgroup))
 
-    for phrase in filter_phrases:
-        pos = question.find(phrase)
-        if pos != -1:
-            return True, pos, phrase
+    if best:
+        return True, best[1], best[2]
 
-    return False, -1, None
+    return False, -1, -1
 
 
-def detect_intent(df: pd.DataFrame, question: str):
+def detect_intent(df: pd.DataFrame, q: str, meta: dict):
     """
-    Divide a pergunta em: parte da operação (sum/count/etc)
+    Divide a pergunta (já normalizada) em: parte da operação (sum/count/etc)
     e parte do filtro (empresa = X)
     """
-    q = normalize_text(question)
-    has_filter, pos, phrase = has_filter_intent(q)
+    has_filter, start, end = has_filter_intent(q)
 
     if has_filter:
-        q_operation = q[:pos].strip()                     # antes da frase-chave
-        q_filter    = q[pos+len(phrase):].strip()         # depois da frase-chave
+        q_operation = q[:start].strip()                   # antes da frase-chave
+        q_filter    = q[end:].strip()                     # depois da frase-chave
     else:
         q_operation = q
         q_filter    = None
-    
-    columns = list(df.columns)
 
     # detectar intenção
-    if is_mean_intent(q_operation):  return "mean",  q_filter
-    if is_sum_intent(q_operation):   return "sum",   q_filter
-    if is_count_intent(q_operation): return "count", q_filter
-    if is_list_intent(q_operation):  return "list",  q_filter
+    intents = find_intents(q_operation)
+
+    if "mean"  in intents: return "mean",  q_filter
+    if "sum"   in intents: return "sum",   q_filter
+    if "count" in intents: return "count", q_filter
+    if "list"  in intents: return "list",  q_filter
 
     # tentativa de fallback
-    if has_total_phrase(q_operation):
-        col = extract_column_candidate(q_operation, columns, df)
+    if "total" in intents:
+        col = extract_column_candidate(q_operation, tokenize(q_operation), df, meta)
         if col:
-            if pd.api.types.is_numeric_dtype(df[col]): return "sum", q_filter
+            if col in meta["numeric_cols"]: return "sum", q_filter
             else: return "count", q_filter
         else:
             return "erro_coluna", q_filter
@@ -273,39 +468,43 @@ def detect_intent(df: pd.DataFrame, question: str):
 # EXTRAÇÃO E APLICAÇÃO DE FILTROS
 # ======================================================================
 
-def extract_filters(filter_text: str, df: pd.DataFrame):
+# regex para capturar coluna e valor, compiladas uma única vez e já
+# associadas ao código da operação (eq, neq, gt, lt) usado em apply_filters
+_FILTER_PATTERNS = [
+    (re.compile(r"(\w+)\s*=\s*([\w\s\-\.\:\/]+)"),  "eq"),
+    (re.compile(r"(\w+)\s*==\s*([\w\s\-\.\:\/]+)"), "eq"),
+    (re.compile(r"(\w+)\s*!=\s*([\w\s\-\.\:\/]+)"), "neq"),
+    (re.compile(r"(\w+)\s*>\s*([\d\.]+)"),          "gt"),
+    (re.compile(r"(\w+)\s*<\s*([\d\.]+)"),          "lt"),
+]
+
+
+def extract_filters(f: str, df: pd.DataFrame, meta: dict):
     """
-    Extrai filtros do tipo:
+    Extrai filtros (de um texto já normalizado) do tipo:
     coluna = valor,
     coluna != valor,
     coluna > número,
     coluna < número
     """
-    if not filter_text:
+    if not f:
         return []
 
-    f = normalize_text(filter_text)
-
-    # regex para capturar coluna e valor
-    patterns = [
-        r"(\w+)\s*=\s*([\w\s\-\.\:\/]+)",
-        r"(\w+)\s*==\s*([\w\s\-\.\:\/]+)",
-        r"(\w+)\s*!=\s*([\w\s\-\.\:\/]+)",
-        r"(\w+)\s*>\s*([\d\.]+)",
-        r"(\w+)\s*<\s*([\d\.]+)"
-    ]
-
     filters = []
 
-    for pat in patterns:
-        matches = re.findall(pat, f)
-        for col_raw, val_raw in matches:
+    for regex, op in _FILTER_PATTERNS:
+        for col_raw, val_raw in regex.findall(f):
+
+            # o nome digitado sempre resolve para a mesma coluna na sessão: memoiza
+            filter_columns = meta["filter_columns"]
+            if col_raw not in filter_columns:
+                filter_columns[col_raw] = extract_column_candidate(col_raw, {col_raw}, df, meta)
 
-            col = extract_column_candidate(col_raw, df.columns, df)
+            col = filter_columns[col_raw]
             if not col:
                 continue
 
-            val = normalize_text(val_raw).rstrip(".,;!?: ")
+            val = val_raw.strip().rstrip(".,;!?: ")
 
             # tenta converter para número
             try:
@@ -313,47 +512,85 @@ def extract_filters(filter_text: str, df: pd.DataFrame):
             except:
                 pass
 
-            filters.append((col, pat, val))
+            filters.append((col, op, val))
 
     return filters
 
 
-def apply_filters(df: pd.DataFrame, filters):
+def get_value_index(df: pd.DataFrame, col, meta: dict):
     """
-    Aplica lista de filtros ao DataFrame.
+    Índice invertido da coluna (valor normalizado -> posições das linhas), montado
+    no primeiro filtro textual de igualdade sobre ela e memoizado na sessão.
+    Retorna None para colunas de alta cardinalidade, que usam a comparação de códigos.
+    """
+    index = meta["index"]
+    if col not in index:
+        series_norm = df[col + "_norm"]
+        if len(series_norm.cat.categories) > INDEX_MAX_DISTINCT_RATIO * len(df):
+            index[col] = None
+        else:
+            index[col] = df.groupby(col + "_norm", sort=False, observed=True).indices
+    return index[col]
+
+
+def apply_filters(df: pd.DataFrame, filters, meta: dict):
+    """
+    Aplica lista de filtros (coluna, operação, valor) ao DataFrame.
     Operações numéricas usam coluna original.
-    Operações textuais usam coluna normalizada *_norm.
+    Operações textuais usam coluna normalizada *_norm; igualdade textual
+    consulta o índice invertido da coluna (quando houver) em vez de varrer a coluna.
+    Acumula uma única máscara booleana e indexa o DataFrame só no final.
     """
-    df2 = df.copy()
+    mask = np.ones(len(df), dtype=bool)
+    rows = None                                           # posições vindas do índice (igualdade textual)
 
-    for col, pat, val in filters:
+    for col, op, val in filters:
 
         is_numeric = isinstance(val, (int, float))
 
         if is_numeric:
-            if   ">" in pat: df2 = df2[df2[col] > val]
-            elif "<" in pat: df2 = df2[df2[col] < val]
-            else:            df2 = df2[df2[col] == val]
+            values = df[col].to_numpy()
+
+            if   op == "gt":  mask &= values > val
+            elif op == "lt":  mask &= values < val
+            elif op == "neq": mask &= values != val
+            else:             mask &= values == val
 
         else:
             col_norm = col + "_norm"
-            val_norm = normalize_text(val)
+            val_norm = val                                # já normalizado em extract_filters
+
+            index = get_value_index(df, col, meta) if op == "eq" else None
+            if index is not None:
+                hits = index.get(val_norm, NO_ROWS)
+                rows = hits if rows is None else np.intersect1d(rows, hits, assume_unique=True)
+                continue
 
-            series_norm = df2[col_norm].fillna('')
+            series_norm = df[col_norm]
+            categories  = series_norm.cat.categories
 
-            if "!=" in pat:
-                df2 = df2[series_norm != val_norm]
+            # valor ausente das categorias => nenhuma linha é igual a ele
+            if val_norm in categories:
+                submask = series_norm.cat.codes.to_numpy() == categories.get_loc(val_norm)
             else:
-                df2 = df2[series_norm == val_norm]
+                submask = np.zeros(len(df), dtype=bool)
 
-    return df2
+            if op == "neq":
+                mask &= ~submask
+            else:
+                mask &= submask
+
+    if rows is not None:
+        return df.iloc[rows[mask[rows]]]
+
+    return df.loc[mask]
 
 
 # ======================================================================
 # PIPELINE FINAL: ENTENDER A PERGUNTA E RESPONDER
 # ======================================================================
 
-def parse_and_answer(df: pd.DataFrame, pergunta: str):
+def parse_and_answer(df: pd.DataFrame, pergunta: str, meta: dict = None):
     """
     Função completa que:
     - identifica intenção
@@ -362,16 +599,22 @@ def parse_and_answer(df: pd.DataFrame, pergunta: str):
     - identifica coluna da operação
     - executa operação
     """
-    intent, filter_part = detect_intent(df, pergunta)
+    if meta is None:
+        meta = build_column_meta(df)
+
+    q = normalize_text(pergunta)                          # normaliza uma única vez por pergunta
+
+    intent, filter_part = detect_intent(df, q, meta)
 
-    filters = extract_filters(filter_part, df)
+    filters = extract_filters(filter_part, df, meta)
 
-    df_filtered = apply_filters(df, filters) if filters else df
+    df_filtered = apply_filters(df, filters, meta) if filters else df
 
     coluna = extract_column_candidate(
-        pergunta,
-        df.columns,
+        q,
+        tokenize(q),
         df,
+        meta,
         numeric_only = intent in ["sum", "mean"]
     )
 
@@ -392,51 +635,94 @@ def parse_and_answer(df: pd.DataFrame, pergunta: str):
 # ENDPOINTS FASTAPI
 # ======================================================================
 
+class UploadResp(BaseModel):
+    session_id: str
+    message:    str
+    columns:    list
+
+
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...)) -> UploadResp:
     """
     Recebe um arquivo .xlsx do usuário e cria uma sessão contendo o DataFrame.
     """
     if not file.filename.endswith(".xlsx"):
         raise HTTPException(400, "Apenas arquivos .xlsx são suportados")
 
-    contents = await file.read()                                               # lê bytes do arquivo
-    df = pd.read_excel(BytesIO(contents))                                      # converte para DataFrame
+    # grava o upload em disco em blocos, sem carregar o arquivo inteiro na memória,
+    # calculando o hash do conteúdo no mesmo laço
+    hasher = xxhash.xxh64()
+    tmp = NamedTemporaryFile(suffix=".xlsx", delete=False)
+
+    try:
+        with tmp:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                tmp.write(chunk)
+                hasher.update(chunk)
+
+        cache_path = CACHE_DIR / f"{CACHE_VERSION}-{hasher.hexdigest()}.parquet"
 
-    df = prepare_normalized_columns(df)                                        # cria colunas *_norm
+        df = load_cached_frame(cache_path)                                     # mesmo arquivo já processado?
+        if df is None:
+            df = pd.read_excel(tmp.name, engine="calamine")                    # converte para DataFrame (parser em Rust)
+            df = prepare_normalized_columns(df)                                # cria colunas *_norm
+            save_cached_frame(df, cache_path)
+    finally:
+        os.unlink(tmp.name)                                                    # remove o arquivo temporário
+
+    meta = build_column_meta(df)                                               # pré-calcula nomes normalizados
 
     session_id = str(uuid.uuid4())                                             # gera ID de sessão
-    sessions[session_id] = {"df": df, "history": []}                           # guarda DF e histórico vazio
+    with sessions_lock:
+        sessions[session_id] = {"df": df, "meta": meta,                        # guarda DF, metadados e histórico vazio
+                                "history": deque(maxlen=HISTORY_MAXLEN),
+                                "lock": Lock()}                                # protege o histórico da sessão
+
+    return UploadResp(
+        session_id = session_id,
+        message    = f"Arquivo {file.filename} recebido com sucesso",
+        columns    = list(df.columns)
+    )
+
+
+class AskReq(BaseModel):
+    session_id: str
+    question:   str
+
 
-    return JSONResponse({
-        "session_id": session_id,
-        "message": f"Arquivo {file.filename} recebido com sucesso",
-        "columns": list(df.columns)
-    })
+class AskResp(BaseModel):
+    answer:  str
+    history: list
 
 
 @app.post("/ask")
-async def ask(payload: dict):
+def ask(req: AskReq) -> AskResp:
     """
     Recebe uma pergunta do usuário e retorna a resposta da análise.
+    Função síncrona: o FastAPI a executa no threadpool, então a análise (pandas)
+    não bloqueia o event loop, e o acesso compartilhado é protegido por locks.
     """
-    sessao_id = payload.get("session_id")
-    pergunta  = payload.get("question")
+    sessao_id = req.session_id
+    pergunta  = req.question
 
     if not sessao_id or not pergunta:
         raise HTTPException(400, '"session_id" e "question" são obrigatórios!')
 
-    sessao = sessions.get(sessao_id)
+    with sessions_lock:
+        sessao = sessions.get(sessao_id)
     if not sessao:
         raise HTTPException(404, "Sessão não encontrada")
 
     df = sessao["df"]
-    answer = parse_and_answer(df, pergunta)
+    answer = parse_and_answer(df, pergunta, sessao["meta"])
 
-    # salva histórico
-    sessao["history"].append({"q": pergunta, "a": answer})
+    # salva histórico e tira uma cópia para a resposta (iterar o deque enquanto
+    # outra requisição da mesma sessão faz append levantaria RuntimeError)
+    with sessao["lock"]:
+        sessao["history"].append({"q": pergunta, "a": answer})
+        history = list(sessao["history"])
 
-    return JSONResponse({"answer": answer, "history": sessao["history"]})
+    return AskResp(answer=answer, history=history)
 
 
 # ======================================================================